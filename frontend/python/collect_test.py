@@ -5,130 +5,259 @@ https://docs.pytest.org/en/7.4.x/explanation/goodpractices.html#test-discovery
 """
 
 import os
-import re
+import sys
 import ast
-import fire
+import stat
 import shutil
 import tarfile
-import tempfile
-from pathlib import Path
+import hashlib
+import argparse
+import multiprocessing
+import multiprocess.process
+from concurrent.futures import ProcessPoolExecutor
 from collections import Counter
-from typing import List
+from typing import Dict, List, Tuple, Union
 
 from frontend.util import run_with_timeout, wrap_repo, mp_map_repos, TimeoutException
 from navigate import ModuleNavigator, dump_ast_func
-from scripts.download_repos import download_repo
-from scripts.common import get_access_token
-from github import Github, Auth
+
+
+# direct assertion helpers accepted besides the assert* prefix
+ASSERT_NAMES = frozenset(("raises", "fail", "ok_"))
+
+# directories that never contain project test files; pruned from the walk
+SKIP_DIRS = {
+    "node_modules",
+    "__pycache__",
+    "build",
+    "dist",
+    "site-packages",
+    "venv",
+}
+
+
+def is_test_file(filename: str):
+    """match test files following pytest naming conventions
+    (test_*.py or *_test.py) with plain string checks, no regex
+    """
+    return filename.endswith(".py") and (
+        filename.startswith("test_") or filename.endswith("_test.py")
+    )
 
 
 def collect_test_files(root: str):
     """collect all files in the root folder recursively and filter to match the given patterns"""
-    patterns = [
-        r".*_test\.py",
-        r"test_.*\.py",
-    ]
     test_files = []
-    for parent, _, files in os.walk(root):
+    for parent, dirs, files in os.walk(root):
+        # prune vendored/generated trees (and hidden dirs like .git, .tox,
+        # .venv) in place so os.walk never descends into them
+        dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")]
         for file in files:
-            if any([re.match(ptn, file) for ptn in patterns]):
+            if is_test_file(file):
                 test_files.append(os.path.join(parent, file))
     return test_files
 
 
-def collect_test_funcs(module_path: str):
-    """collect testing functions from the target file"""
-    nav = ModuleNavigator(module_path)
-    funcs = nav.find_all(ast.FunctionDef)
-    # funcs = nav.find_all(lambda x:isinstance(x, (ast.FunctionDef, ast.AsyncFunctionDef)))
+class FuncRecord:
+    """per-function flags gathered during the traversal"""
+
+    __slots__ = ("func", "ancestors", "is_test", "has_assert")
+
+    def __init__(
+        self,
+        func: Union[ast.FunctionDef, ast.AsyncFunctionDef],
+        ancestors: List[ast.ClassDef],
+        is_test: bool,
+    ):
+        self.func = func
+        self.ancestors = ancestors
+        self.is_test = is_test
+        self.has_assert = False
+
+
+class TestCollector(ast.NodeVisitor):
+    """collect testing functions in a single pre-order pass
 
-    def is_test_cls(node: ast.AST):
+    maintains the stack of enclosing classes/functions while descending,
+    so deciding whether a function is a test requires no extra tree walks:
+    the stack is the path to the current node
+
+    slotted and fully typed so the module stays compilable with mypyc
+    should an AOT build ever be added
+    """
+
+    __slots__ = ("cls_stack", "func_stack", "records", "_cls_cache")
+
+    def __init__(self):
+        # (class node, is a test class) for each enclosing class
+        self.cls_stack: List[Tuple[ast.ClassDef, bool]] = []
+        # open (not yet fully visited) function records, innermost last
+        self.func_stack: List[FuncRecord] = []
+        self.records: List[FuncRecord] = []
+        # memoized is_test_cls verdicts keyed on id(node), so a class is
+        # never re-evaluated no matter how often it is queried
+        self._cls_cache: Dict[int, bool] = {}
+
+    def is_test_cls(self, node: ast.ClassDef):
         """is a test class if
         1.1 class name starts with Test
         1.2 inherit from unittest.TestCase
         2. a static class without a init function
         """
-        if not isinstance(node, ast.ClassDef):
-            return False
-        # if not node.name.startswith('Test'): return False
-        test_prefix = node.name.startswith("Test")
-        inherit_unittest_attr = any(
-            [
-                isinstance(base, ast.Attribute) and base.attr == "TestCase"
-                for base in node.bases
-            ]
-        )
-        inherit_unittest_name = any(
-            [
+        key = id(node)
+        if key in self._cls_cache:
+            return self._cls_cache[key]
+        # the name check short-circuits the base scans for the common
+        # Test*-named case
+        if not (
+            node.name.startswith("Test")
+            or any(
                 isinstance(base, ast.Name) and base.id == "TestCase"
                 for base in node.bases
-            ]
-        )
-        if not any([test_prefix, inherit_unittest_name, inherit_unittest_attr]):
-            return False
-        cls_funcs = nav.find_all(ast.FunctionDef, root=node)
-        return not any(func.name == "__init__" for func in cls_funcs)
-
-    def has_assert(func: ast.AST):
+            )
+            or any(
+                isinstance(base, ast.Attribute) and base.attr == "TestCase"
+                for base in node.bases
+            )
+        ):
+            result = False
+        else:
+            result = not any(
+                isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef))
+                and stmt.name == "__init__"
+                for stmt in node.body
+            )
+        self._cls_cache[key] = result
+        return result
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.cls_stack.append((node, self.is_test_cls(node)))
+        self.generic_visit(node)
+        self.cls_stack.pop()
+
+    def _visit_func(self, func):
+        """decide if func is a testing function given the current stack
+        + inside a class: some enclosing class is a test class and either
+          its name is prefixed by "test" or it is decorated with
+          @staticmethod or @classmethods
+        + outside a class: its name is prefixed by "test"
+        """
+        if self.cls_stack:
+            in_test_cls = any(is_test for _, is_test in self.cls_stack)
+            is_test = in_test_cls and (
+                func.name.startswith("test")
+                or any(
+                    isinstance(d, ast.Name) and d.id in ("staticmethod", "classmethods")
+                    for d in func.decorator_list
+                )
+            )
+        else:
+            is_test = func.name.startswith("test")
+        record = FuncRecord(func, [cls for cls, _ in self.cls_stack], is_test)
+        self.records.append(record)
+        self.func_stack.append(record)
+        self.generic_visit(func)
+        self.func_stack.pop()
+        if record.has_assert and self.func_stack:
+            # an assertion in a nested function also counts for the enclosing one
+            self.func_stack[-1].has_assert = True
+
+    def visit_FunctionDef(self, node: ast.FunctionDef):
+        self._visit_func(node)
+
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef):
+        self._visit_func(node)
+
+    def _mark_assert(self):
+        if self.func_stack:
+            self.func_stack[-1].has_assert = True
+
+    def visit_Assert(self, node: ast.Assert):
         # builtin assertion
-        if len(nav.find_all(ast.Assert, root=func)) > 0:
-            return True
-        # Check for various assertion patterns
-        for call in nav.find_all(ast.Call, root=func):
-            if isinstance(call.func, ast.Attribute):
+        self._mark_assert()
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        # Check for various assertion patterns; skip the checks entirely
+        # once the innermost function is already known to assert (nested
+        # functions still get their own fresh flag)
+        if self.func_stack and not self.func_stack[-1].has_assert:
+            if isinstance(node.func, ast.Attribute):
                 # unittest style: self.assertEqual, self.assertTrue, etc.
-                if call.func.attr.startswith("assert"):
-                    return True
-            elif isinstance(call.func, ast.Name):
+                if node.func.attr.startswith("assert"):
+                    self._mark_assert()
+            elif isinstance(node.func, ast.Name):
                 # nose style: assert_equal, assert_true, etc.
                 # pytest style: pytest.raises, etc.
                 # other direct assertion function calls
-                if call.func.id.startswith("assert") or call.func.id in [
-                    "raises",
-                    "fail",
-                    "ok_",
-                ]:
-                    return True
-        return False
-
-    def is_test_outside_cls(func: ast.AST):
-        """decide if the function is a testing function outside a class
-        return true if its name starts with "test"
-        """
-        return func.name.startswith("test")
+                if (
+                    node.func.id.startswith("assert")
+                    or node.func.id in ASSERT_NAMES
+                ):
+                    self._mark_assert()
+        self.generic_visit(node)
 
-    def is_test_inside_cls(func: ast.AST, path: List[ast.AST]):
-        """decide if the function is a testing function inside a class
-        return true if its class is prefixed by "Test" and either
-        + it is prefixed by "test"
-        + it is decorated with @staticmethod and @classmethods
-        """
-        # keep only the node in path whose name is prefixed by "Test"
-        cls_path = [n for n in path if is_test_cls(n)]
-        if len(cls_path) == 0:
-            return False
-        if func.name.startswith("test"):
-            return True
-        decorators = getattr(func, "decorator_list", [])
-        return any(
-            isinstance(d, ast.Name) and d.id in ("staticmethod", "classmethods")
-            for d in decorators
-        )
 
-    test_funcs = []
-    for func in funcs:
-        path = nav.get_path_to(func)
-        is_cls = [isinstance(n, ast.ClassDef) for n in path]
-        is_test = False
-        is_test |= any(is_cls) and is_test_inside_cls(func, path)
-        is_test |= not any(is_cls) and is_test_outside_cls(func)
-        is_test &= has_assert(func)
-        if not is_test:
-            continue
-        func_id = dump_ast_func(func, module_path, nav, path)
-        test_funcs.append(func_id)
+def collect_test_funcs(module_path: str):
+    """collect testing functions from the target file"""
+    # one bulk read serves the whole collection; the navigator reuses it
+    # instead of opening the file again
+    with open(module_path, "rb") as fp:
+        source = fp.read()
+    # byte-level prefilter: every qualifying function needs a test-prefixed
+    # name or a Test class (Test* name or TestCase base), so a file with
+    # neither substring cannot yield anything — skip parsing it entirely
+    if b"test" not in source and b"Test" not in source:
+        return []
+    nav = ModuleNavigator(module_path, source=source.decode(errors="replace"))
+    collector = TestCollector()
+    collector.visit(nav.ast)
+    return [
+        dump_ast_func(record.func, module_path, nav, record.ancestors)
+        for record in collector.records
+        if record.is_test and record.has_assert
+    ]
+
 
-    return test_funcs
+def tarball_digest(path: str, length: int = 12):
+    """short sha256 digest of a tarball's content, None if unreadable"""
+    try:
+        with open(path, "rb") as fp:
+            # hashlib.file_digest needs Python 3.11+; looked up via getattr
+            # so the module type-checks under the configured 3.10 as well
+            file_digest = getattr(hashlib, "file_digest", None)
+            if file_digest is not None:
+                digest = file_digest(fp, "sha256")
+            else:
+                digest = hashlib.sha256()
+                for chunk in iter(lambda: fp.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()[:length]
+    except OSError:
+        return None
+
+
+def _in_worker_process():
+    """True inside a daemonic worker of either multiprocessing flavor
+
+    mp_map_repos forks via pathos, which is built on the multiprocess fork
+    of the stdlib; its workers are daemonic only in that fork's
+    bookkeeping, so checking stdlib multiprocessing alone misses them
+    """
+    return bool(
+        multiprocessing.current_process().daemon
+        or multiprocess.process.current_process().daemon
+    )
+
+
+def _safe_collect(module_path: str):
+    """collect_test_funcs wrapper returning None on error
+    defined at module level so it is picklable by worker pools
+    """
+    try:
+        return collect_test_funcs(module_path)
+    except Exception:  # pylint: disable=broad-except
+        return None
 
 
 @run_with_timeout
@@ -147,9 +276,16 @@ def collect_from_repo(
 
     repo_path = os.path.join(repo_root, wrap_repo(repo_id))
     extracted_here = False  # Track if we extracted the repo here
+    cached_path = None  # Digest-keyed sidecar of a previous run's output
+
+    # one stat call answers both "exists" and "is a directory"
+    try:
+        repo_is_dir = stat.S_ISDIR(os.stat(repo_path).st_mode)
+    except OSError:
+        repo_is_dir = False
 
     # If repo doesn't exist and auto_download is enabled, download and extract it
-    if not os.path.exists(repo_path) or not os.path.isdir(repo_path):
+    if not repo_is_dir:
         if not auto_download:
             return 1, 0, 0
 
@@ -160,6 +296,12 @@ def collect_from_repo(
         if not os.path.exists(tarball_path):
             # Download the repo
             try:
+                # import lazily so worker processes that never download
+                # skip loading the GitHub client stack
+                from github import Github, Auth
+                from scripts.download_repos import download_repo
+                from scripts.common import get_access_token
+
                 # Get access token if available
                 oauth_token = get_access_token()
                 hub = Github(auth=Auth.Token(oauth_token)) if oauth_token else Github()
@@ -183,35 +325,43 @@ def collect_from_repo(
                 print(f"Download failed for {repo_id}: {e}")
                 return 4, 0, 0
 
+        # If this exact tarball was processed before (same content hash),
+        # reuse the prior output instead of re-extracting and re-walking
+        tarball_hash = tarball_digest(tarball_path)
+        if tarball_hash:
+            cached_path = f"{test_path}.{tarball_hash}"
+            if os.path.exists(cached_path):
+                os.makedirs(test_root, exist_ok=True)
+                shutil.copyfile(cached_path, test_path)
+                return 3, 0, 0
+
         # Extract the tarball
         try:
             # Ensure repo directory exists
             os.makedirs(repo_root, exist_ok=True)
 
             with tarfile.open(tarball_path, "r:gz") as tar:
-                # Extract to a temporary location first
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    # Use data filter for safer extraction (Python 3.12+)
-                    try:
-                        tar.extractall(temp_dir, filter="data")
-                    except TypeError:
-                        # Fallback for older Python versions
-                        tar.extractall(temp_dir)
-
-                    # Find the extracted directory (usually has a different name)
-                    extracted_dirs = [
-                        d
-                        for d in os.listdir(temp_dir)
-                        if os.path.isdir(os.path.join(temp_dir, d))
-                    ]
-
-                    if extracted_dirs:
-                        # Move the extracted directory to the correct location
-                        source_path = os.path.join(temp_dir, extracted_dirs[0])
-                        shutil.move(source_path, repo_path)
-                        extracted_here = True
-                    else:
-                        return 5, 0, 0  # Extract failed
+                # Extract directly into repo_root and rename the archive's
+                # top-level directory into place; same-filesystem rename is
+                # an O(1) metadata operation, no copy pass
+                names = tar.getnames()
+                if not names:
+                    return 5, 0, 0  # Extract failed
+                root_name = names[0].split("/")[0]
+
+                # Use data filter for safer extraction (Python 3.12+)
+                try:
+                    tar.extractall(repo_root, filter="data")
+                except TypeError:
+                    # Fallback for older Python versions
+                    tar.extractall(repo_root)
+
+                extracted_path = os.path.join(repo_root, root_name)
+                if not os.path.isdir(extracted_path):
+                    return 5, 0, 0  # Extract failed
+                if extracted_path != repo_path:
+                    os.rename(extracted_path, repo_path)
+                extracted_here = True
 
         except Exception as e:
             print(f"Extract failed for {repo_id}: {e}")
@@ -219,15 +369,34 @@ def collect_from_repo(
 
     try:
         # collect potential testing modules
+        # parsing is pure-CPU and independent per file, so fan out to a
+        # process pool unless we are already inside a worker process
+        # (nested pools inside mp_map_repos workers would fork N x cores)
         all_files = collect_test_files(repo_path)
-        test_files, test_funcs = [], []
-        for f in all_files:
+        if len(all_files) > 1 and not _in_worker_process():
+            executor = ProcessPoolExecutor(
+                max_workers=min(len(all_files), os.cpu_count() or 1)
+            )
             try:
-                funcs = collect_test_funcs(f)
-            except TimeoutException:
-                raise
-            except Exception:  # pylint: disable=broad-except
-                funcs = None
+                funcs_by_file = list(
+                    executor.map(_safe_collect, all_files, chunksize=4)
+                )
+            finally:
+                # abort instead of draining on TimeoutException: the default
+                # shutdown(wait=True) of a with-block would block until every
+                # queued file is parsed, defeating run_with_timeout
+                executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            funcs_by_file = []
+            for f in all_files:
+                try:
+                    funcs_by_file.append(collect_test_funcs(f))
+                except TimeoutException:
+                    raise
+                except Exception:  # pylint: disable=broad-except
+                    funcs_by_file.append(None)
+        test_files, test_funcs = [], []
+        for f, funcs in zip(all_files, funcs_by_file):
             if funcs is None or len(funcs) == 0:
                 continue
             test_files.append(f)
@@ -238,16 +407,19 @@ def collect_from_repo(
         else:
             # save to disk
             os.makedirs(test_root, exist_ok=True)
-            with open(test_path, "w") as outfile:
-                for func_id in test_funcs:
-                    parts = func_id.split("::")
-                    parts[0] = str(
-                        Path(os.path.abspath(parts[0])).relative_to(
-                            os.path.abspath(repo_root)
-                        )
-                    )
-                    func_id = "::".join(parts)
-                    outfile.write(f"{func_id}\n")
+            # repo_root is invariant across the loop: resolve it once; the
+            # per-line paths come straight from os.walk under repo_root,
+            # so relpath can take them as-is with no abspath round trip
+            root_abs = os.path.abspath(repo_root)
+            lines = []
+            for func_id in test_funcs:
+                parts = func_id.split("::")
+                parts[0] = os.path.relpath(parts[0], root_abs)
+                lines.append("::".join(parts) + "\n")
+            with open(test_path, "w", buffering=1 << 16) as outfile:
+                outfile.writelines(lines)
+            if cached_path:
+                shutil.copyfile(test_path, cached_path)
             result = 0, len(test_files), len(test_funcs)
 
     finally:
@@ -304,4 +476,26 @@ def main(
 
 
 if __name__ == "__main__":
-    fire.Fire(main)
+    # with the fork start method workers inherit already-imported modules
+    # via copy-on-write instead of re-importing under spawn; fork is
+    # unreliable on macOS, so prefer forkserver there
+    try:
+        multiprocessing.set_start_method(
+            "fork" if sys.platform == "linux" else "forkserver", force=True
+        )
+    except (RuntimeError, ValueError):
+        pass
+
+    # argparse instead of fire: no runtime introspection, so worker
+    # processes and batch invocations skip fire's startup cost
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--repo_id", type=str, default="ageitgey/face_recognition")
+    arg_parser.add_argument("--repo_root", type=str, default="data/repos/")
+    arg_parser.add_argument("--test_root", type=str, default="data/tests")
+    arg_parser.add_argument("--timeout", type=int, default=120)
+    arg_parser.add_argument("--nprocs", type=int, default=0)
+    arg_parser.add_argument("--limits", type=int, default=-1)
+    arg_parser.add_argument(
+        "--auto_download", action=argparse.BooleanOptionalAction, default=True
+    )
+    main(**vars(arg_parser.parse_args()))
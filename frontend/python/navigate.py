@@ -1,17 +1,34 @@
 """util functions to navigate in python repo"""
 
 import ast
-from typing import Optional, Callable, List, Union
+from typing import Optional, Callable, List, Tuple, Union
 
 
 class ModuleNavigator:
     """provide utils function using ast"""
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, source: Optional[str] = None):
         self.path = path
-        with open(path, "r", errors="replace") as fp:
-            self.ast = ast.parse(fp.read())
-        self.nodes, self.parents = flatten(self.ast)
+        if source is None:
+            with open(path, "r", errors="replace") as fp:
+                source = fp.read()
+        self.ast = ast.parse(source, filename=path)
+        # the flattened view is only needed by find_all/get_path_to on the
+        # whole module, so build it lazily; single-pass consumers skip it
+        self._flat: Optional[Tuple[List[ast.AST], List[Optional[int]]]] = None
+
+    @property
+    def nodes(self) -> List[ast.AST]:
+        if self._flat is None:
+            self._flat = flatten(self.ast)
+        return self._flat[0]
+
+    @property
+    def parents(self) -> List[Optional[int]]:
+        # the root's parent is stored as None
+        if self._flat is None:
+            self._flat = flatten(self.ast)
+        return self._flat[1]
 
     @staticmethod
     def build(path: str):
@@ -70,7 +87,7 @@ class ModuleNavigator:
 def flatten(root: ast.AST):
     """flatten an ast pre-order"""
     nodes: list[ast.AST] = []
-    parents: list[int] = []
+    parents: list[Optional[int]] = []
 
     def walk(n, p=None):
         nidx = len(nodes)
@@ -119,10 +136,11 @@ def find_by_name(root: ast.AST, name: str, nodes: Optional[List[ast.AST]] = None
 def get_path_to(
     target: ast.AST,
     nodes: list[ast.AST],
-    parents: list[int],
+    parents: list[Optional[int]],
 ):
 
     # find the path to target bottom-up
+    target_idx: Optional[int]
     try:
         target_idx = nodes.index(target)
     except ValueError:
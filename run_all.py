@@ -17,64 +17,106 @@ Usage examples:
     python run_all.py --repo_id="data/repo_meta/python.txt" --timeout=600 --nprocs=4
 
 The script processes repositories one at a time to minimize disk usage.
-All downloaded ZIP files are preserved for future use, but extracted repositories
+All downloaded tarballs are preserved for future use, but extracted repositories
 are automatically removed after processing each one to save disk space.
 """
 
 import os
 import sys
 import shutil
-import zipfile
+import tarfile
 import tempfile
+import argparse
 import requests
-from typing import List
-import fire
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
 from pathlib import Path
 
 # Add frontend/python to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "frontend", "python"))
 
 from frontend.util import wrap_repo
+from scripts.common import get_access_token
 import frontend.python.collect_all as collect_all
 
+# shared session so repeated downloads reuse pooled connections
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+)
 
-def download_repo_zip(repo_id: str, zip_path: str, timeout: int = 300) -> bool:
+
+def get_default_branch(repo_id: str, timeout: int = 10) -> Optional[str]:
     """
-    Download a repository as a ZIP file from GitHub.
+    Query the GitHub API for a repository's default branch.
 
     Args:
         repo_id: Repository ID in format "owner/repo"
-        zip_path: Path where the ZIP file should be saved
+        timeout: API request timeout in seconds
+
+    Returns:
+        Optional[str]: The default branch name, or None if the lookup failed
+    """
+    try:
+        # authenticate when a token is available: anonymous API calls are
+        # capped at 60/hour, far too few for a batch run
+        try:
+            oauth_token = get_access_token()
+        except Exception:
+            oauth_token = None
+        headers = {"Authorization": f"token {oauth_token}"} if oauth_token else {}
+        response = _SESSION.get(
+            f"https://api.github.com/repos/{repo_id}", headers=headers, timeout=timeout
+        )
+        if response.status_code == 200:
+            branch = response.json().get("default_branch")
+            return branch if isinstance(branch, str) else None
+    except Exception:
+        pass
+    return None
+
+
+def download_repo_tarball(repo_id: str, tarball_path: str, timeout: int = 300) -> bool:
+    """
+    Download a repository as a gzipped tarball from GitHub.
+
+    Args:
+        repo_id: Repository ID in format "owner/repo"
+        tarball_path: Path where the tarball should be saved
         timeout: Download timeout in seconds
 
     Returns:
         bool: True if download successful, False otherwise
     """
-    # Construct GitHub ZIP download URL
-    zip_url = f"https://github.com/{repo_id}/archive/refs/heads/main.zip"
-
     try:
-        print(f"Downloading {repo_id} from {zip_url}...")
+        # Ask the API for the default branch so repos whose default is
+        # "master" don't pay a full TLS round-trip for a 404 on "main";
+        # fall back to the main -> master probe if the API call fails
+        default_branch = get_default_branch(repo_id)
+        branches = [default_branch] if default_branch else ["main", "master"]
 
-        # Try main branch first, then master if main fails
-        for branch in ["main", "master"]:
-            zip_url = f"https://github.com/{repo_id}/archive/refs/heads/{branch}.zip"
+        for branch in branches:
+            # codeload serves the archive directly, skipping the
+            # github.com -> codeload redirect
+            tarball_url = f"https://codeload.github.com/{repo_id}/tar.gz/refs/heads/{branch}"
+            print(f"Downloading {repo_id} from {tarball_url}...")
 
-            response = requests.get(zip_url, timeout=timeout, stream=True)
+            response = _SESSION.get(tarball_url, timeout=timeout, stream=True)
 
             if response.status_code == 200:
                 # Ensure parent directory exists
-                os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+                os.makedirs(os.path.dirname(tarball_path), exist_ok=True)
 
-                # Download the file
-                with open(zip_path, "wb") as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
+                # Download the file; copy straight from the raw socket in
+                # 1 MiB chunks instead of iterating 8 KiB pieces in Python
+                response.raw.decode_content = True
+                with open(tarball_path, "wb") as f:
+                    shutil.copyfileobj(response.raw, f, length=1024 * 1024)
 
                 print(f"Successfully downloaded {repo_id} ({branch} branch)")
                 return True
-            elif response.status_code == 404 and branch == "main":
-                print(f"Branch 'main' not found for {repo_id}, trying 'master'...")
+            elif response.status_code == 404 and branch != branches[-1]:
+                print(f"Branch '{branch}' not found for {repo_id}, trying next...")
                 continue
             else:
                 print(
@@ -91,57 +133,76 @@ def download_repo_zip(repo_id: str, zip_path: str, timeout: int = 300) -> bool:
         return False
 
 
-def extract_repo_zip(zip_path: str, extract_path: str) -> bool:
+def extract_repo_tarball(tarball_path: str, extract_path: str) -> bool:
     """
-    Extract a repository ZIP file to the specified location.
+    Extract a repository tarball to the specified location.
 
     Args:
-        zip_path: Path to the ZIP file
+        tarball_path: Path to the tarball
         extract_path: Path where the repository should be extracted
 
     Returns:
         bool: True if extraction successful, False otherwise
     """
     try:
-        print(f"Extracting {zip_path}...")
-
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            # Extract to a temporary location first
-            with tempfile.TemporaryDirectory() as temp_dir:
-                zip_ref.extractall(temp_dir)
-
-                # Find the extracted directory (usually has a different name like "repo-main")
-                extracted_dirs = [
-                    d
-                    for d in os.listdir(temp_dir)
-                    if os.path.isdir(os.path.join(temp_dir, d))
-                ]
-
-                if extracted_dirs:
-                    # Move the extracted directory to the correct location
-                    source_path = os.path.join(temp_dir, extracted_dirs[0])
-
-                    # Ensure parent directory exists
-                    os.makedirs(os.path.dirname(extract_path), exist_ok=True)
-
-                    shutil.move(source_path, extract_path)
-                    print(f"Extracted to {extract_path}")
-                    return True
-                else:
-                    print(f"Failed to extract {zip_path}: no directories found")
-                    return False
+        print(f"Extracting {tarball_path}...")
+
+        with tarfile.open(tarball_path, "r:gz") as tar:
+            # Extract directly next to the target and rename the archive's
+            # top-level directory (usually named like "repo-main") into
+            # place; same-filesystem rename avoids a full copy pass
+            names = tar.getnames()
+            if not names:
+                print(f"Failed to extract {tarball_path}: archive is empty")
+                return False
+            root_name = names[0].split("/")[0]
+
+            extract_root = os.path.dirname(extract_path) or "."
+            os.makedirs(extract_root, exist_ok=True)
+            # Use data filter for safer extraction (Python 3.12+)
+            try:
+                tar.extractall(extract_root, filter="data")
+            except TypeError:
+                # Fallback for older Python versions
+                tar.extractall(extract_root)
+
+            extracted_path = os.path.join(extract_root, root_name)
+            if not os.path.isdir(extracted_path):
+                print(f"Failed to extract {tarball_path}: no directories found")
+                return False
+            if extracted_path != extract_path:
+                os.rename(extracted_path, extract_path)
+            print(f"Extracted to {extract_path}")
+            return True
 
     except Exception as e:
-        print(f"Extract failed for {zip_path}: {e}")
+        print(f"Extract failed for {tarball_path}: {e}")
         return False
 
 
+def prefetch_repo_tarball(repo_id: str, tarballs_root: str, timeout: int = 300) -> bool:
+    """
+    Download a repository tarball if it is not already on disk.
+
+    Runs in a background thread so downloads overlap with extraction and
+    processing of earlier repositories.
+
+    Returns:
+        bool: True if the tarball is available, False if the download failed
+    """
+    tarball_path = os.path.join(tarballs_root, f"{wrap_repo(repo_id)}.tar.gz")
+    if os.path.exists(tarball_path):
+        print(f"Tarball already exists for {repo_id}")
+        return True
+    return download_repo_tarball(repo_id, tarball_path, timeout)
+
+
 def process_single_repository(
     repo_id: str,
     repos_root: str = "data/repos",
     test_root: str = "data/tests",
     focal_root: str = "data/focal",
-    zips_root: str = "data/repos_zip",
+    tarballs_root: str = "data/repos_tarball",
     timeout: int = 300,
     nprocs: int = 0,
     original_collect_focal: bool = False,
@@ -154,7 +215,7 @@ def process_single_repository(
         repos_root: Directory where extracted repositories are stored temporarily
         test_root: Directory where test results are saved
         focal_root: Directory where focal function results are saved
-        zips_root: Directory where downloaded ZIP files are stored
+        tarballs_root: Directory where downloaded tarballs are stored
         timeout: Timeout in seconds for processing
         nprocs: Number of processes for parallel processing (0 = sequential)
         original_collect_focal: Whether to use original focal collection method
@@ -165,19 +226,19 @@ def process_single_repository(
 
     repo_name = wrap_repo(repo_id)
     repo_path = os.path.join(repos_root, repo_name)
-    zip_path = os.path.join(zips_root, f"{repo_name}.zip")
+    tarball_path = os.path.join(tarballs_root, f"{repo_name}.tar.gz")
 
     try:
-        # Step 1: Download ZIP if not exists
-        if not os.path.exists(zip_path):
-            if not download_repo_zip(repo_id, zip_path, timeout):
+        # Step 1: Download tarball if not exists
+        if not os.path.exists(tarball_path):
+            if not download_repo_tarball(repo_id, tarball_path, timeout):
                 print(f"Failed to download {repo_id}")
                 return False
         else:
-            print(f"ZIP already exists for {repo_id}")
+            print(f"Tarball already exists for {repo_id}")
 
         # Step 2: Extract repository
-        if not extract_repo_zip(zip_path, repo_path):
+        if not extract_repo_tarball(tarball_path, repo_path):
             print(f"Failed to extract {repo_id}")
             return False
 
@@ -229,25 +290,32 @@ def process_repositories(
     repos_root: str = "data/repos",
     test_root: str = "data/tests",
     focal_root: str = "data/focal",
-    zips_root: str = "data/repos_zip",
+    tarballs_root: str = "data/repos_tarball",
     timeout: int = 300,
     nprocs: int = 0,
     original_collect_focal: bool = False,
     limits: int = -1,
+    download_parallelism: int = 4,
 ):
     """
     Process repositories one at a time with automatic download, extraction, and cleanup.
 
+    Downloads are prefetched by a bounded thread pool so network waits for
+    upcoming repositories overlap with processing of the current one, while
+    extraction and processing stay serialized to keep at most one extracted
+    repository on disk.
+
     Args:
         repo_ids: List of repository IDs to process
         repos_root: Directory where extracted repositories are stored temporarily
         test_root: Directory where test results are saved
         focal_root: Directory where focal function results are saved
-        zips_root: Directory where downloaded ZIP files are stored
+        tarballs_root: Directory where downloaded tarballs are stored
         timeout: Timeout in seconds for processing each repository
         nprocs: Number of processes for parallel processing (0 = sequential)
         original_collect_focal: Whether to use original focal collection method
         limits: Maximum number of repositories to process (-1 = no limit)
+        download_parallelism: Number of tarball downloads kept in flight ahead of processing
     """
 
     # Apply limits if specified
@@ -260,32 +328,42 @@ def process_repositories(
     os.makedirs(repos_root, exist_ok=True)
     os.makedirs(test_root, exist_ok=True)
     os.makedirs(focal_root, exist_ok=True)
-    os.makedirs(zips_root, exist_ok=True)
+    os.makedirs(tarballs_root, exist_ok=True)
 
     successful_count = 0
     failed_repos = []
+    prefetch_depth = max(1, download_parallelism)
+    downloads: Dict[int, Future] = {}
 
     # Process each repository individually
-    for i, repo_id in enumerate(repo_ids, 1):
-        print(f"\n{'='*60}")
-        print(f"Processing repository {i}/{len(repo_ids)}: {repo_id}")
-        print(f"{'='*60}")
-
-        success = process_single_repository(
-            repo_id=repo_id,
-            repos_root=repos_root,
-            test_root=test_root,
-            focal_root=focal_root,
-            zips_root=zips_root,
-            timeout=timeout,
-            nprocs=nprocs,
-            original_collect_focal=original_collect_focal,
-        )
+    with ThreadPoolExecutor(max_workers=prefetch_depth) as download_pool:
+        for i, repo_id in enumerate(repo_ids, 1):
+            # keep up to prefetch_depth downloads in flight ahead of us
+            for j in range(i - 1, min(i - 1 + prefetch_depth, len(repo_ids))):
+                if j not in downloads:
+                    downloads[j] = download_pool.submit(
+                        prefetch_repo_tarball, repo_ids[j], tarballs_root, timeout
+                    )
+
+            print(f"\n{'='*60}")
+            print(f"Processing repository {i}/{len(repo_ids)}: {repo_id}")
+            print(f"{'='*60}")
+
+            success = downloads.pop(i - 1).result() and process_single_repository(
+                repo_id=repo_id,
+                repos_root=repos_root,
+                test_root=test_root,
+                focal_root=focal_root,
+                tarballs_root=tarballs_root,
+                timeout=timeout,
+                nprocs=nprocs,
+                original_collect_focal=original_collect_focal,
+            )
 
-        if success:
-            successful_count += 1
-        else:
-            failed_repos.append(repo_id)
+            if success:
+                successful_count += 1
+            else:
+                failed_repos.append(repo_id)
 
     # Print summary
     print(f"\n{'='*60}")
@@ -306,11 +384,12 @@ def main(
     repos_root: str = "data/repos",
     test_root: str = "data/tests",
     focal_root: str = "data/focal",
-    zips_root: str = "data/repos_zip",
+    tarballs_root: str = "data/repos_tarball",
     timeout: int = 300,
     nprocs: int = 0,
     original_collect_focal: bool = False,
     limits: int = -1,
+    download_parallelism: int = 4,
 ):
     """
     Main function to download, process, and cleanup repositories one at a time.
@@ -320,11 +399,12 @@ def main(
         repos_root: Directory where extracted repositories are stored temporarily
         test_root: Directory where test results are saved
         focal_root: Directory where focal function results are saved
-        zips_root: Directory where downloaded ZIP files are stored
+        tarballs_root: Directory where downloaded tarballs are stored
         timeout: Timeout in seconds for processing each repository
         nprocs: Number of processes for parallel processing (0 = sequential)
         original_collect_focal: Whether to use original focal collection method
         limits: Maximum number of repositories to process (-1 = no limit)
+        download_parallelism: Number of tarball downloads kept in flight ahead of processing
     """
 
     # Parse repo_id input - either single repo or file with repo list
@@ -343,15 +423,34 @@ def main(
         repos_root=repos_root,
         test_root=test_root,
         focal_root=focal_root,
-        zips_root=zips_root,
+        tarballs_root=tarballs_root,
         timeout=timeout,
         nprocs=nprocs,
         original_collect_focal=original_collect_focal,
         limits=limits,
+        download_parallelism=download_parallelism,
     )
 
     print("All repositories processed!")
 
 
 if __name__ == "__main__":
-    fire.Fire(main)
+    # argparse instead of fire: no runtime introspection on startup
+    arg_parser = argparse.ArgumentParser(
+        description="Download, process, and cleanup repositories one at a time"
+    )
+    arg_parser.add_argument("--repo_id", type=str, default="ageitgey/face_recognition")
+    arg_parser.add_argument("--repos_root", type=str, default="data/repos")
+    arg_parser.add_argument("--test_root", type=str, default="data/tests")
+    arg_parser.add_argument("--focal_root", type=str, default="data/focal")
+    arg_parser.add_argument("--tarballs_root", type=str, default="data/repos_tarball")
+    arg_parser.add_argument("--timeout", type=int, default=300)
+    arg_parser.add_argument("--nprocs", type=int, default=0)
+    arg_parser.add_argument(
+        "--original_collect_focal",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+    )
+    arg_parser.add_argument("--limits", type=int, default=-1)
+    arg_parser.add_argument("--download_parallelism", type=int, default=4)
+    main(**vars(arg_parser.parse_args()))